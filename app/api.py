@@ -1,16 +1,25 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Header, Response, Depends
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 import pandas as pd
 import pickle
+import json
+import logging
 import os
 import sys
+import time
 
 # Añadir el directorio src al path para importar las funciones
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
-from recommend import load_data, get_hybrid_recommendations, get_content_recommendations, get_popular_recommendations
+from recommend import load_data, get_hybrid_recommendations, get_bulk_hybrid_recommendations, get_content_recommendations, get_popular_recommendations, build_movie_index, build_filter_mask
+from quantization import QuantizedScorer, SCORING_DTYPES
+from sharding import ShardCoordinator
+import profiling
 
 from pydantic import BaseModel
-from typing import List
+from typing import List, Optional
+
+logger = logging.getLogger("recommender.api")
 
 app = FastAPI(title="Sistema de Recomendación Híbrido", version="1.0.0")
 
@@ -29,16 +38,28 @@ tfidf_vectorizer = None
 cosine_sim_matrix = None
 movies = None
 ratings = None
+genre_masks = None
+release_years = None
+scorer = None
+content_index = None
+shard_coordinator = None
+
+# Modo de puntuación SVD: "exact" (por defecto), "float32" o "int8"
+SCORING_MODE = os.environ.get("SCORING_MODE", "exact")
+# Número de shards de películas (0 = sin particionar); tiene prioridad sobre SCORING_MODE
+SHARDS = int(os.environ.get("SHARDS", "0"))
 
 @app.on_event("startup")
 async def load_models():
-    global svd_model, tfidf_vectorizer, cosine_sim_matrix, movies, ratings
+    global svd_model, tfidf_vectorizer, cosine_sim_matrix, movies, ratings, genre_masks, release_years, scorer
+    global content_index, shard_coordinator
     
     # Cargar datos
     data_path = '../data/ml-1m/'
     movies_path = os.path.join(data_path, 'movies.dat')
     ratings_path = os.path.join(data_path, 'ratings.dat')
     ratings, movies = load_data(movies_path, ratings_path)
+    genre_masks, release_years = build_movie_index(movies)
     
     # Cargar modelos
     models_path = '../models/'
@@ -52,8 +73,39 @@ async def load_models():
     with open(os.path.join(models_path, 'cosine_sim_matrix.pkl'), 'rb') as f:
         cosine_sim_matrix = pickle.load(f)
     
+    if SHARDS > 0:
+        # Cada shard se queda con su parte de factores y similitudes; el proceso principal libera la matriz
+        shard_coordinator = ShardCoordinator(svd_model, movies, cosine_sim_matrix, n_shards=SHARDS)
+        scorer = content_index = shard_coordinator
+        cosine_sim_matrix = None
+    elif SCORING_MODE in SCORING_DTYPES:
+        scorer = QuantizedScorer(svd_model, movies, dtype=SCORING_MODE)
+    
     print("Modelos y datos cargados exitosamente")
 
+@app.on_event("shutdown")
+async def close_shards():
+    if shard_coordinator is not None:
+        shard_coordinator.close()
+
+def _parse_genres(genres):
+    if not genres:
+        return None
+    return [g.strip() for g in genres.split(",") if g.strip()]
+
+def _get_filter_mask(include_genres, exclude_genres, min_year, max_year):
+    # Filtros de género (separados por comas) y rango de años aplicados antes del top-n
+    try:
+        return build_filter_mask(
+            genre_masks, release_years,
+            include_genres=_parse_genres(include_genres),
+            exclude_genres=_parse_genres(exclude_genres),
+            min_year=min_year,
+            max_year=max_year
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 # ----------------- Rutas de la API ----------------- #
 
 @app.get("/")
@@ -61,17 +113,29 @@ async def root():
     return {"message": "Sistema de Recomendación Híbrido API"}
 
 @app.get("/recommend/user/{user_id}")
-async def recommend_for_user(user_id: int, n: int = 10):
+async def recommend_for_user(user_id: int, response: Response, n: int = 10, include_genres: Optional[str] = None, exclude_genres: Optional[str] = None,
+                             min_year: Optional[int] = None, max_year: Optional[int] = None, x_profile: Optional[str] = Header(None),
+                             x_admin_token: Optional[str] = Header(None)):
     if svd_model is None or movies is None or ratings is None:
         raise HTTPException(status_code=500, detail="Modelos no cargados")
     
     if user_id not in ratings['user_id'].values:
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
     
+    filter_mask = _get_filter_mask(include_genres, exclude_genres, min_year, max_year)
+    
     try:
-        recommendations = get_hybrid_recommendations(
-            user_id, svd_model, movies, cosine_sim_matrix, ratings, n=n
+        recommendations, profile_id = profiling.run_with_profiling(
+            f"/recommend/user/{user_id}",
+            lambda timings: get_hybrid_recommendations(
+                user_id, svd_model, movies, cosine_sim_matrix, ratings, n=n, filter_mask=filter_mask, timings=timings,
+                scorer=scorer, content_index=content_index
+            ),
+            debug_header=x_profile,
+            admin_token=x_admin_token
         )
+        if profile_id is not None:
+            response.headers["X-Profile-Id"] = profile_id
         
         result = []
         for _, row in recommendations.iterrows():
@@ -90,16 +154,19 @@ async def recommend_for_user(user_id: int, n: int = 10):
         raise HTTPException(status_code=500, detail=f"Error generando recomendaciones: {str(e)}")
 
 @app.get("/recommend/movie/{movie_id}")
-async def recommend_similar_movies(movie_id: int, n: int = 10):
-    if cosine_sim_matrix is None or movies is None:
+async def recommend_similar_movies(movie_id: int, n: int = 10, include_genres: Optional[str] = None, exclude_genres: Optional[str] = None,
+                                   min_year: Optional[int] = None, max_year: Optional[int] = None):
+    if (cosine_sim_matrix is None and content_index is None) or movies is None:
         raise HTTPException(status_code=500, detail="Modelos no cargados")
     
     if movie_id not in movies['movie_id'].values:
         raise HTTPException(status_code=404, detail="Película no encontrada")
     
+    filter_mask = _get_filter_mask(include_genres, exclude_genres, min_year, max_year)
+    
     try:
         recommendations = get_content_recommendations(
-            movie_id, movies, cosine_sim_matrix, n=n
+            movie_id, movies, cosine_sim_matrix, n=n, filter_mask=filter_mask, content_index=content_index
         )
         
         result = []
@@ -119,12 +186,15 @@ async def recommend_similar_movies(movie_id: int, n: int = 10):
         raise HTTPException(status_code=500, detail=f"Error generando recomendaciones: {str(e)}")
 
 @app.get("/recommend/popular")
-async def get_popular_movies(n: int = 10):
+async def get_popular_movies(n: int = 10, include_genres: Optional[str] = None, exclude_genres: Optional[str] = None,
+                             min_year: Optional[int] = None, max_year: Optional[int] = None):
     if movies is None or ratings is None:
         raise HTTPException(status_code=500, detail="Datos no cargados")
     
+    filter_mask = _get_filter_mask(include_genres, exclude_genres, min_year, max_year)
+    
     try:
-        popular_movies = get_popular_recommendations(ratings, movies, n=n)
+        popular_movies = get_popular_recommendations(ratings, movies, n=n, filter_mask=filter_mask)
         
         result = []
         for _, row in popular_movies.iterrows():
@@ -244,25 +314,40 @@ class CustomProfileRatings(BaseModel):
     ratings: List[RatingModel]
 
 @app.post("/recommend/custom_profile")
-async def recommend_for_custom_profile(custom_profile_ratings: CustomProfileRatings, n: int = 10):
+async def recommend_for_custom_profile(custom_profile_ratings: CustomProfileRatings, response: Response, n: int = 10, include_genres: Optional[str] = None,
+                                       exclude_genres: Optional[str] = None, min_year: Optional[int] = None, max_year: Optional[int] = None,
+                                       x_profile: Optional[str] = Header(None), x_admin_token: Optional[str] = Header(None)):
     if svd_model is None or movies is None or ratings is None:
         raise HTTPException(status_code=500, detail="Modelos no cargados")
     
     if not custom_profile_ratings.ratings:
         raise HTTPException(status_code=400, detail="Se requieren valoraciones para generar recomendaciones.")
     
+    filter_mask = _get_filter_mask(include_genres, exclude_genres, min_year, max_year)
+    
     user_ratings_list = [{"movie_id": r.movie_id, "rating": r.rating} for r in custom_profile_ratings.ratings]
     
     try:
-        recommendations = get_hybrid_recommendations(
-            user_id=None,
-            svd_model=svd_model,
-            movies=movies,
-            cosine_sim=cosine_sim_matrix,
-            ratings_df=ratings,
-            n=n,
-            custom_ratings=user_ratings_list
+        recommendations, profile_id = profiling.run_with_profiling(
+            "/recommend/custom_profile",
+            lambda timings: get_hybrid_recommendations(
+                user_id=None,
+                svd_model=svd_model,
+                movies=movies,
+                cosine_sim=cosine_sim_matrix,
+                ratings_df=ratings,
+                n=n,
+                custom_ratings=user_ratings_list,
+                filter_mask=filter_mask,
+                timings=timings,
+                scorer=scorer,
+                content_index=content_index
+            ),
+            debug_header=x_profile,
+            admin_token=x_admin_token
         )
+        if profile_id is not None:
+            response.headers["X-Profile-Id"] = profile_id
         
         result = []
         for _, row in recommendations.iterrows():
@@ -279,6 +364,117 @@ async def recommend_for_custom_profile(custom_profile_ratings: CustomProfileRati
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error generando recomendaciones para perfil personalizado: {str(e)}")
 
+# ----------------- Recomendaciones masivas (NDJSON) ----------------- #
+class BulkRecommendationRequest(BaseModel):
+    user_ids: Optional[List[int]] = None
+    user_id_start: Optional[int] = None
+    user_id_end: Optional[int] = None
+    profiles: Optional[List[CustomProfileRatings]] = None
+
+def _stream_bulk_recommendations(user_ids, missing_user_ids, profiles, n, filter_mask):
+    # Generador síncrono: StreamingResponse lo consume en un hilo y solo pide la siguiente
+    # línea cuando la anterior se ha enviado, así un cliente lento frena el cálculo (backpressure)
+    start = time.perf_counter()
+    rows = 0
+    errors = len(missing_user_ids)
+    for user_id in missing_user_ids:
+        yield json.dumps({"user_id": user_id, "error": "Usuario no encontrado"}) + "\n"
+    # El estado 200 ya se ha enviado: un fallo se comunica con una línea de error antes del resumen
+    try:
+        results = get_bulk_hybrid_recommendations(
+            user_ids, svd_model, movies, cosine_sim_matrix, ratings, n=n, custom_profiles=profiles,
+            filter_mask=filter_mask, scorer=scorer, content_index=content_index
+        )
+        for i, (key, recommendations) in enumerate(results):
+            result = [
+                {"movie_id": int(row["movie_id"]), "title": row["title"], "genres": row["genres"]}
+                for _, row in recommendations.iterrows()
+            ]
+            line = {"user_id": int(key)} if i < len(user_ids) else {"profile": int(key)}
+            line.update({"recommendations": result, "count": len(result)})
+            yield json.dumps(line) + "\n"
+            rows += 1
+    except Exception as e:
+        errors += 1
+        yield json.dumps({"error": f"Error generando recomendaciones masivas: {str(e)}"}) + "\n"
+    elapsed = time.perf_counter() - start
+    summary = {"rows": rows, "errors": errors, "elapsed_s": round(elapsed, 3),
+               "rows_per_second": round(rows / elapsed, 1) if elapsed > 0 else None}
+    logger.info("Recomendaciones masivas: %d filas en %.2fs (%s filas/s)", rows, elapsed, summary["rows_per_second"])
+    yield json.dumps({"summary": summary}) + "\n"
+
+@app.post("/recommend/bulk")
+async def recommend_bulk(request: BulkRecommendationRequest, n: int = 10, include_genres: Optional[str] = None,
+                         exclude_genres: Optional[str] = None, min_year: Optional[int] = None, max_year: Optional[int] = None):
+    if svd_model is None or movies is None or ratings is None:
+        raise HTTPException(status_code=500, detail="Modelos no cargados")
+    
+    has_range = request.user_id_start is not None or request.user_id_end is not None
+    if not request.user_ids and not has_range and not request.profiles:
+        raise HTTPException(status_code=400, detail="Se requieren user_ids, un rango de usuarios o perfiles personalizados.")
+    
+    if request.user_id_start is not None and request.user_id_end is not None and request.user_id_start > request.user_id_end:
+        raise HTTPException(status_code=400, detail="user_id_start no puede ser mayor que user_id_end.")
+    
+    if any(not profile.ratings for profile in request.profiles or []):
+        raise HTTPException(status_code=400, detail="Se requieren valoraciones para generar recomendaciones.")
+    
+    filter_mask = _get_filter_mask(include_genres, exclude_genres, min_year, max_year)
+    
+    known_user_ids = set(ratings["user_id"].unique().tolist())
+    user_ids, missing_user_ids = [], []
+    for user_id in request.user_ids or []:
+        (user_ids if user_id in known_user_ids else missing_user_ids).append(user_id)
+    if has_range:
+        # En un rango solo se incluyen los usuarios existentes
+        low = request.user_id_start if request.user_id_start is not None else min(known_user_ids)
+        high = request.user_id_end if request.user_id_end is not None else max(known_user_ids)
+        user_ids += sorted(u for u in known_user_ids if low <= u <= high)
+    # Cada usuario se puntúa una sola vez aunque aparezca en la lista y en el rango
+    user_ids = list(dict.fromkeys(user_ids))
+    missing_user_ids = list(dict.fromkeys(missing_user_ids))
+    profiles = [[{"movie_id": r.movie_id, "rating": r.rating} for r in profile.ratings] for profile in request.profiles or []]
+    
+    return StreamingResponse(
+        _stream_bulk_recommendations(user_ids, missing_user_ids, profiles, n, filter_mask),
+        media_type="application/x-ndjson"
+    )
+
+# ----------------- Rutas de administración (perfilado) ----------------- #
+async def require_admin(x_admin_token: Optional[str] = Header(None)):
+    if not profiling.is_admin(x_admin_token):
+        raise HTTPException(status_code=403, detail="Token de administración no válido")
+
+# Solo se registran si el perfilado o el registro de peticiones lentas está configurado
+if profiling.PROFILING_CONFIGURED:
+    @app.get("/admin/profiles", dependencies=[Depends(require_admin)])
+    async def list_profiles():
+        result = [
+            {key: record[key] for key in ("profile_id", "label", "timestamp", "elapsed_ms", "stages_ms", "peak_memory_bytes")}
+            for record in reversed(profiling.profiles.values())
+        ]
+        return {"profiles": result, "count": len(result)}
+
+    @app.get("/admin/profiles/{profile_id}", dependencies=[Depends(require_admin)])
+    async def get_profile(profile_id: str):
+        if profile_id not in profiling.profiles:
+            raise HTTPException(status_code=404, detail="Perfil no encontrado")
+        return profiling.profiles[profile_id]
+
+    @app.get("/admin/slow_requests", dependencies=[Depends(require_admin)])
+    async def get_slow_requests():
+        result = list(reversed(profiling.slow_requests))
+        return {"threshold_ms": profiling.SLOW_REQUEST_MS, "slow_requests": result, "count": len(result)}
+
+if SCORING_MODE in SCORING_DTYPES:
+    @app.get("/admin/scoring_report", dependencies=[Depends(require_admin)])
+    async def get_scoring_report(users: int = 50, n: int = 10):
+        if not isinstance(scorer, QuantizedScorer):
+            raise HTTPException(status_code=400, detail=f"Modo de puntuación compacta no activo (SCORING_MODE={SCORING_MODE})")
+        
+        user_ids = ratings["user_id"].drop_duplicates().sample(min(users, ratings["user_id"].nunique()), random_state=42)
+        return scorer.report(user_ids.tolist(), n=n)
+
 # ----------------- Ejecutar servidor ----------------- #
 if __name__ == "__main__":
     import uvicorn
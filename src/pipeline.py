@@ -0,0 +1,194 @@
+import hashlib
+import inspect
+import json
+import os
+import pickle
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from recommend import (load_data, split_ratings, fit_svd, evaluate_svd, add_soup, fit_tfidf,
+                       build_cosine_index)
+
+# Parámetros por defecto (se sobrescriben con params.yaml si existe)
+DEFAULT_PARAMS = {
+    "split": {"test_size": 0.2, "random_state": 42},
+    "svd": {"n_factors": 100, "n_epochs": 20, "lr_all": 0.005, "reg_all": 0.02, "random_state": 42},
+    "tfidf": {"stop_words": "english"},
+}
+
+def load_params(params_path="params.yaml"):
+    params = {section: dict(values) for section, values in DEFAULT_PARAMS.items()}
+    if params_path and os.path.exists(params_path):
+        import yaml
+        with open(params_path) as f:
+            overrides = yaml.safe_load(f) or {}
+        for section, values in overrides.items():
+            params.setdefault(section, {}).update(values or {})
+    return params
+
+# ----------------- Etapas ----------------- #
+# Cada etapa recibe los artefactos de sus dependencias y sus parámetros,
+# y devuelve un diccionario {nombre_de_fichero: objeto}.
+
+def stage_ingest(deps, params, data_path):
+    ratings, movies = load_data(os.path.join(data_path, "movies.dat"), os.path.join(data_path, "ratings.dat"))
+    return {"ratings.pkl": ratings, "movies.pkl": movies}
+
+def stage_split(deps, params, data_path):
+    trainset, testset = split_ratings(deps["ingest"]["ratings.pkl"], **params)
+    return {"trainset.pkl": trainset, "testset.pkl": testset}
+
+def stage_train_cf(deps, params, data_path):
+    return {"svd_model.pkl": fit_svd(deps["split"]["trainset.pkl"], **params)}
+
+def stage_train_content(deps, params, data_path):
+    movies = add_soup(deps["ingest"]["movies.pkl"])
+    tfidf, tfidf_matrix = fit_tfidf(movies, **params)
+    return {"tfidf_vectorizer.pkl": tfidf, "tfidf_matrix.pkl": tfidf_matrix, "movies_with_soup.pkl": movies}
+
+def stage_build_index(deps, params, data_path):
+    return {"cosine_sim_matrix.pkl": build_cosine_index(deps["train_content"]["tfidf_matrix.pkl"])}
+
+def stage_evaluate(deps, params, data_path):
+    return {"metrics.json": {"rmse": evaluate_svd(deps["train_cf"]["svd_model.pkl"], deps["split"]["testset.pkl"])}}
+
+# deps: etapas de las que depende; params: sección de params.yaml;
+# publish: artefactos que se copian a models/ para la API y DVC;
+# code: funciones auxiliares cuyo código también forma parte de la clave de caché
+STAGES = {
+    "ingest": {"fn": stage_ingest, "deps": [], "params": None, "publish": [], "code": [load_data]},
+    "split": {"fn": stage_split, "deps": ["ingest"], "params": "split", "publish": [], "code": [split_ratings]},
+    "train_cf": {"fn": stage_train_cf, "deps": ["split"], "params": "svd", "publish": ["svd_model.pkl"], "code": [fit_svd]},
+    "train_content": {"fn": stage_train_content, "deps": ["ingest"], "params": "tfidf",
+                      "publish": ["tfidf_vectorizer.pkl", "movies_with_soup.pkl"], "code": [add_soup, fit_tfidf]},
+    "build_index": {"fn": stage_build_index, "deps": ["train_content"], "params": None, "publish": ["cosine_sim_matrix.pkl"],
+                    "code": [build_cosine_index]},
+    "evaluate": {"fn": stage_evaluate, "deps": ["split", "train_cf"], "params": None, "publish": ["metrics.json"],
+                 "code": [evaluate_svd]},
+}
+
+# ----------------- Caché direccionada por contenido ----------------- #
+
+def file_digest(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def compute_stage_keys(params, data_path):
+    # La clave de cada etapa depende de su código, sus parámetros y las claves de sus dependencias
+    data_digests = {name: file_digest(os.path.join(data_path, name)) for name in ("movies.dat", "ratings.dat")}
+    keys = {}
+    for name, stage in STAGES.items():  # STAGES está en orden topológico
+        payload = {
+            "stage": name,
+            "code": hashlib.sha256("".join(inspect.getsource(fn) for fn in [stage["fn"]] + stage.get("code", [])).encode()).hexdigest(),
+            "params": params.get(stage["params"]) if stage["params"] else None,
+            "deps": [keys[d] for d in stage["deps"]],
+            "data": data_digests if not stage["deps"] else None,
+        }
+        keys[name] = hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()[:16]
+    return keys
+
+def stage_dir(cache_dir, name, key):
+    return os.path.join(cache_dir, name, key)
+
+def is_cached(cache_dir, name, key):
+    return os.path.isdir(stage_dir(cache_dir, name, key))
+
+def save_artifacts(cache_dir, name, key, artifacts):
+    # Se escribe en un directorio temporal y se renombra para que la entrada sea atómica
+    os.makedirs(os.path.join(cache_dir, name), exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(dir=os.path.join(cache_dir, name))
+    for filename, obj in artifacts.items():
+        with open(os.path.join(tmp_dir, filename), "w" if filename.endswith(".json") else "wb") as f:
+            if filename.endswith(".json"):
+                json.dump(obj, f, indent=2)
+            else:
+                pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+    try:
+        os.rename(tmp_dir, stage_dir(cache_dir, name, key))
+    except OSError:
+        # Otro proceso guardó la misma entrada antes
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+def load_artifacts(cache_dir, name, key):
+    artifacts = {}
+    directory = stage_dir(cache_dir, name, key)
+    for filename in os.listdir(directory):
+        with open(os.path.join(directory, filename), "r" if filename.endswith(".json") else "rb") as f:
+            artifacts[filename] = json.load(f) if filename.endswith(".json") else pickle.load(f)
+    return artifacts
+
+def run_stage(name, keys, params, data_path, cache_dir):
+    stage = STAGES[name]
+    deps = {d: load_artifacts(cache_dir, d, keys[d]) for d in stage["deps"]}
+    stage_params = params.get(stage["params"]) if stage["params"] else None
+    artifacts = stage["fn"](deps, stage_params, data_path)
+    save_artifacts(cache_dir, name, keys[name], artifacts)
+    return name
+
+def prune_cache(cache_dir, name, key):
+    # Borra las entradas de la etapa que no corresponden a la clave actual (los
+    # directorios temporales de otras escrituras en curso se respetan)
+    directory = os.path.join(cache_dir, name)
+    if not os.path.isdir(directory):
+        return []
+    removed = [entry for entry in os.listdir(directory) if entry != key and not entry.startswith("tmp")]
+    for entry in removed:
+        shutil.rmtree(os.path.join(directory, entry), ignore_errors=True)
+    return removed
+
+def publish(name, key, cache_dir, models_path):
+    for filename in STAGES[name]["publish"]:
+        shutil.copyfile(os.path.join(stage_dir(cache_dir, name, key), filename), os.path.join(models_path, filename))
+
+# ----------------- Ejecución ----------------- #
+
+def plan_stages(targets, keys, cache_dir):
+    # Solo se ejecutan las etapas sin caché y las dependencias sin caché que necesitan
+    pending = set()
+    stack = list(targets)
+    while stack:
+        name = stack.pop()
+        if name in pending or is_cached(cache_dir, name, keys[name]):
+            continue
+        pending.add(name)
+        stack.extend(STAGES[name]["deps"])
+    return pending
+
+def run_pipeline(targets=None, params=None, data_path="./data/ml-1m/", models_path="./models/", cache_dir=None, max_workers=None,
+                 prune=True):
+    targets = list(targets or STAGES)
+    params = params if params is not None else load_params()
+    cache_dir = cache_dir or os.path.join(models_path, "cache")
+    os.makedirs(models_path, exist_ok=True)
+
+    keys = compute_stage_keys(params, data_path)
+    pending = plan_stages(targets, keys, cache_dir)
+    for name in STAGES:
+        if name in targets and name not in pending:
+            print(f"Etapa {name}: en caché ({keys[name]})")
+
+    # Las etapas independientes (p. ej. train_cf y train_content) se ejecutan en procesos paralelos
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        running = {}
+        while pending or running:
+            for name in [s for s in STAGES if s in pending]:
+                if all(d not in pending and d not in running.values() for d in STAGES[name]["deps"]):
+                    print(f"Etapa {name}: ejecutando ({keys[name]})")
+                    running[pool.submit(run_stage, name, keys, params, data_path, cache_dir)] = name
+                    pending.discard(name)
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                print(f"Etapa {future.result()}: completada")
+                del running[future]
+
+    for name in targets:
+        publish(name, keys[name], cache_dir, models_path)
+        # Solo se conserva la entrada actual de cada etapa ejecutada (es lo que versiona DVC)
+        if prune:
+            prune_cache(cache_dir, name, keys[name])
+    return keys
@@ -0,0 +1,117 @@
+import cProfile
+import hmac
+import io
+import logging
+import os
+import pstats
+import random
+import time
+import tracemalloc
+import uuid
+from collections import OrderedDict, deque
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+
+logger = logging.getLogger("recommender.profiling")
+
+# Configuración por variables de entorno (todo desactivado por defecto)
+# PROFILING_ENABLED=1       -> permite perfilar peticiones con la cabecera X-Profile: 1
+#                              (solo junto a X-Admin-Token con el valor de ADMIN_TOKEN)
+# PROFILE_SAMPLE_RATE=0.01  -> fracción de peticiones perfiladas por muestreo
+# SLOW_REQUEST_MS=500       -> registra el desglose por etapas de las peticiones más lentas
+# ADMIN_TOKEN=...           -> token exigido para la cabecera de perfilado y las rutas /admin
+PROFILING_ENABLED = os.environ.get("PROFILING_ENABLED", "0") == "1"
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", "0"))
+SLOW_REQUEST_MS = float(os.environ["SLOW_REQUEST_MS"]) if os.environ.get("SLOW_REQUEST_MS") else None
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN") or None
+PROFILING_CONFIGURED = PROFILING_ENABLED or PROFILE_SAMPLE_RATE > 0 or SLOW_REQUEST_MS is not None
+
+MAX_PROFILES = 20
+MAX_SLOW_REQUESTS = 100
+TOP_N_STATS = 30
+
+profiles = OrderedDict()
+slow_requests = deque(maxlen=MAX_SLOW_REQUESTS)
+
+def stage_timer(timings, stage):
+    # Sin diccionario de tiempos no se mide nada (coste nulo cuando está desactivado)
+    if timings is None:
+        return nullcontext()
+    return _timed(timings, stage)
+
+@contextmanager
+def _timed(timings, stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = timings.get(stage, 0.0) + (time.perf_counter() - start) * 1000
+
+def is_admin(token):
+    # Sin ADMIN_TOKEN configurado nadie tiene acceso de administración
+    if ADMIN_TOKEN is None or token is None:
+        return False
+    return hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode())
+
+def should_profile(debug_header=None, admin_token=None):
+    if debug_header == "1" and PROFILING_ENABLED and is_admin(admin_token):
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+def _store_profile(record):
+    profiles[record["profile_id"]] = record
+    while len(profiles) > MAX_PROFILES:
+        profiles.popitem(last=False)
+
+def run_with_profiling(label, fn, debug_header=None, admin_token=None):
+    # Ejecuta fn(timings) y devuelve (resultado, profile_id o None)
+    profile = should_profile(debug_header, admin_token)
+    timings = {} if profile or SLOW_REQUEST_MS is not None else None
+    if timings is None:
+        return fn(None), None
+
+    profile_id = None
+    start = time.perf_counter()
+    if profile:
+        profile_id = uuid.uuid4().hex[:12]
+        owns_tracemalloc = not tracemalloc.is_tracing()
+        if owns_tracemalloc:
+            tracemalloc.start()
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+            result = fn(timings)
+        finally:
+            profiler.disable()
+            snapshot = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            if owns_tracemalloc:
+                tracemalloc.stop()
+        stats_stream = io.StringIO()
+        pstats.Stats(profiler, stream=stats_stream).sort_stats("cumulative").print_stats(TOP_N_STATS)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        _store_profile({
+            "profile_id": profile_id,
+            "label": label,
+            "timestamp": datetime.now().isoformat(),
+            "elapsed_ms": elapsed_ms,
+            "stages_ms": dict(timings),
+            "peak_memory_bytes": peak,
+            "top_allocations": [str(stat) for stat in snapshot.statistics("lineno")[:TOP_N_STATS]],
+            "cprofile": stats_stream.getvalue(),
+        })
+    else:
+        result = fn(timings)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+
+    if SLOW_REQUEST_MS is not None and elapsed_ms >= SLOW_REQUEST_MS:
+        stages = ", ".join(f"{stage}={ms:.1f}ms" for stage, ms in timings.items())
+        logger.warning("Petición lenta %s: %.1fms (%s)", label, elapsed_ms, stages)
+        slow_requests.append({
+            "label": label,
+            "timestamp": datetime.now().isoformat(),
+            "elapsed_ms": elapsed_ms,
+            "stages_ms": dict(timings),
+            "profile_id": profile_id,
+        })
+    return result, profile_id
@@ -9,6 +9,9 @@ import numpy as np
 import pickle
 import os
 
+from profiling import stage_timer
+from quantization import align_item_factors, user_factors
+
 # Cargar datos
 def load_data(movies_path, ratings_path):
     rnames = ["user_id", "movie_id", "rating", "timestamp"]
@@ -17,83 +20,113 @@ def load_data(movies_path, ratings_path):
     movies = pd.read_csv(movies_path, sep="::", header=None, names=mnames, engine="python", encoding="latin-1")
     return ratings, movies
 
+# Géneros del dataset MovieLens 1M (el orden define el bit de cada género)
+GENRES = [
+    "Action", "Adventure", "Animation", "Children's", "Comedy", "Crime",
+    "Documentary", "Drama", "Fantasy", "Film-Noir", "Horror", "Musical",
+    "Mystery", "Romance", "Sci-Fi", "Thriller", "War", "Western",
+]
+GENRE_BITS = {genre: 1 << i for i, genre in enumerate(GENRES)}
+
+# Índice de géneros y años (se calcula una sola vez por catálogo)
+def build_movie_index(movies):
+    # Máscara de bits por película a partir de la columna "Animation|Children's|Comedy"
+    dummies = movies["genres"].str.get_dummies(sep="|")
+    known = [g for g in dummies.columns if g in GENRE_BITS]
+    bits = np.array([GENRE_BITS[g] for g in known], dtype=np.int64)
+    genre_masks = dummies[known].to_numpy(dtype=np.int64) @ bits if known else np.zeros(len(movies), dtype=np.int64)
+    # Año de estreno extraído del título "Toy Story (1995)"; 0 si no aparece
+    years = movies["title"].str.extract(r"\((\d{4})\)\s*$")[0]
+    release_years = pd.to_numeric(years, errors="coerce").fillna(0).to_numpy(dtype=np.int32)
+    return np.asarray(genre_masks, dtype=np.int64), release_years
+
+def genres_to_mask(genres):
+    mask = 0
+    for genre in genres:
+        if genre not in GENRE_BITS:
+            raise ValueError(f"Género desconocido: {genre}")
+        mask |= GENRE_BITS[genre]
+    return mask
+
+def build_filter_mask(genre_masks, release_years, include_genres=None, exclude_genres=None, min_year=None, max_year=None):
+    # Máscara booleana alineada con las filas de `movies`; None si no hay filtros
+    if not include_genres and not exclude_genres and min_year is None and max_year is None:
+        return None
+    if min_year is not None and max_year is not None and min_year > max_year:
+        raise ValueError(f"Rango de años no válido: min_year ({min_year}) > max_year ({max_year})")
+    keep = np.ones(len(genre_masks), dtype=bool)
+    if include_genres:
+        keep &= (genre_masks & genres_to_mask(include_genres)) != 0
+    if exclude_genres:
+        keep &= (genre_masks & genres_to_mask(exclude_genres)) == 0
+    if min_year is not None or max_year is not None:
+        # Las películas sin año en el título (año 0) no cumplen ningún filtro de año
+        keep &= release_years > 0
+    if min_year is not None:
+        keep &= release_years >= min_year
+    if max_year is not None:
+        keep &= release_years <= max_year
+    return keep
+
 # Modelo de popularidad (Baseline)
-def get_popular_recommendations(ratings, movies, n=10):
+def get_popular_recommendations(ratings, movies, n=10, filter_mask=None):
     movie_popularity = ratings.groupby("movie_id")["rating"].count().sort_values(ascending=False)
+    if filter_mask is not None:
+        allowed_ids = movies["movie_id"].to_numpy()[filter_mask]
+        movie_popularity = movie_popularity[movie_popularity.index.isin(allowed_ids)]
     popular_movie_ids = movie_popularity.head(n).index
     return movies[movies["movie_id"].isin(popular_movie_ids)]
 
 # Filtrado Colaborativo (SVD)
-def train_svd_model(ratings):
+# Estas funciones son el único camino de entrenamiento: las usan las etapas de pipeline.py
+def split_ratings(ratings, test_size=0.2, random_state=42):
     reader = Reader(rating_scale=(1, 5))
     data = Dataset.load_from_df(ratings[["user_id", "movie_id", "rating"]], reader)
-    trainset, testset = train_test_split(data, test_size=0.2, random_state=42)
-    model = SVD(random_state=42)
+    return train_test_split(data, test_size=test_size, random_state=random_state)
+
+def fit_svd(trainset, **params):
+    model = SVD(**params)
     model.fit(trainset)
-    predictions = model.test(testset)
-    rmse = accuracy.rmse(predictions)
-    return model, rmse
+    return model
+
+def evaluate_svd(model, testset):
+    return accuracy.rmse(model.test(testset), verbose=False)
 
 # Recomendador de Contenido (TF-IDF)
-def train_content_model(movies):
+def add_soup(movies):
+    movies = movies.copy()
     movies["soup"] = movies["title"] + " " + movies["genres"]
-    tfidf = TfidfVectorizer(stop_words="english")
-    tfidf_matrix = tfidf.fit_transform(movies["soup"])
-    cosine_sim = cosine_similarity(tfidf_matrix, tfidf_matrix)
-    return tfidf, cosine_sim
+    return movies
+
+def fit_tfidf(movies, **params):
+    tfidf = TfidfVectorizer(**params)
+    return tfidf, tfidf.fit_transform(movies["soup"])
 
-def get_content_recommendations(movie_id, movies, cosine_sim, n=10):
+def build_cosine_index(tfidf_matrix):
+    return cosine_similarity(tfidf_matrix, tfidf_matrix)
+
+def get_content_recommendations(movie_id, movies, cosine_sim, n=10, filter_mask=None, content_index=None):
     if movie_id not in movies["movie_id"].values:
         return pd.DataFrame()
     idx = movies[movies["movie_id"] == movie_id].index[0]
+    if content_index is not None:
+        # Similitud repartida entre shards (ver sharding.ShardCoordinator)
+        return movies.iloc[content_index.similar(idx, filter_mask, n)]
+    if filter_mask is not None:
+        # Se descartan las películas filtradas antes de seleccionar el top-n
+        sim_row = np.where(filter_mask, cosine_sim[idx], -np.inf)
+        sim_row[idx] = -np.inf
+        n_valid = min(n, int(np.isfinite(sim_row).sum()))
+        movie_indices = np.argsort(-sim_row, kind="stable")[:n_valid]
+        return movies.iloc[movie_indices]
     sim_scores = list(enumerate(cosine_sim[idx]))
     sim_scores = sorted(sim_scores, key=lambda x: x[1], reverse=True)
     sim_scores = sim_scores[1:n+1]
     movie_indices = [i[0] for i in sim_scores]
     return movies.iloc[movie_indices]
 
-# Recomendador Híbrido
-def get_hybrid_recommendations(user_id, svd_model, movies, cosine_sim, ratings_df, weight_cf=0.7, weight_content=0.3, n=10, custom_ratings=None):
-    # Si se proporcionan valoraciones personalizadas, se crea un usuario temporal
-    if custom_ratings is not None:
-        # Asignar un user_id temporal que no exista en el dataset original
-        temp_user_id = ratings_df["user_id"].max() + 1 
-        new_ratings_df = pd.DataFrame(custom_ratings)
-        new_ratings_df["user_id"] = temp_user_id
-        new_ratings_df["timestamp"] = pd.to_datetime("now").timestamp()
-        
-        # Combinar con los ratings existentes para el modelo SVD
-        # Nota: Para un modelo SVD ya entrenado, las nuevas valoraciones no afectarán el entrenamiento
-        # pero se usarán para predecir las películas no vistas por este usuario temporal.
-        # Aquí, simplemente las añadimos para que el flujo de 'rated_movie_ids' funcione.
-        # En un escenario real, se reentrenaría el modelo o se usaría un enfoque de cold-start más sofisticado.
-        ratings_for_prediction = pd.concat([ratings_df, new_ratings_df], ignore_index=True)
-        current_user_ratings = new_ratings_df # Las valoraciones del usuario actual
-        user_id_to_use = temp_user_id
-    else:
-        ratings_for_prediction = ratings_df
-        current_user_ratings = ratings_df[ratings_df["user_id"] == user_id]
-        user_id_to_use = user_id
-
-    all_movie_ids = movies["movie_id"].unique()
-    rated_movie_ids = current_user_ratings["movie_id"].tolist()
-    unrated_movie_ids = [mid for mid in all_movie_ids if mid not in rated_movie_ids]
-
-    svd_preds = []
-    for movie_id in unrated_movie_ids:
-        # Asegurarse de que el movie_id existe en el modelo SVD
-        if movie_id in movies["movie_id"].values:
-            svd_preds.append((movie_id, svd_model.predict(user_id_to_use, movie_id).est))
-    svd_preds.sort(key=lambda x: x[1], reverse=True)
-    top_svd_movies = svd_preds[:n]
-
-    content_movie_ids = []
-    if not current_user_ratings.empty:
-        # Usar la película mejor valorada por el usuario para recomendaciones de contenido
-        last_rated_movie_id = current_user_ratings.sort_values(by="rating", ascending=False)["movie_id"].iloc[0]
-        content_recs = get_content_recommendations(last_rated_movie_id, movies, cosine_sim, n=n)
-        content_movie_ids = content_recs["movie_id"].tolist()
-
+# Combinación ponderada de los candidatos de SVD y de contenido
+def combine_hybrid_scores(top_svd_movies, content_movie_ids, weight_cf=0.7, weight_content=0.3, n=10):
     hybrid_scores = {}
     for movie_id, score in top_svd_movies:
         hybrid_scores[movie_id] = score * weight_cf
@@ -105,8 +138,129 @@ def get_hybrid_recommendations(user_id, svd_model, movies, cosine_sim, ratings_d
             hybrid_scores[movie_id] = weight_content * 5
 
     sorted_hybrid_recs = sorted(hybrid_scores.items(), key=lambda x: x[1], reverse=True)
-    top_hybrid_movie_ids = [movie_id for movie_id, score in sorted_hybrid_recs[:n]]
-    return movies[movies["movie_id"].isin(top_hybrid_movie_ids)]
+    return [movie_id for movie_id, score in sorted_hybrid_recs[:n]]
+
+# Recomendador Híbrido
+def get_hybrid_recommendations(user_id, svd_model, movies, cosine_sim, ratings_df, weight_cf=0.7, weight_content=0.3, n=10, custom_ratings=None, filter_mask=None, timings=None, scorer=None, content_index=None):
+    # timings: diccionario opcional donde se acumula el tiempo (ms) de cada etapa
+    with stage_timer(timings, "user_ratings"):
+        # Si se proporcionan valoraciones personalizadas, se crea un usuario temporal
+        if custom_ratings is not None:
+            # Asignar un user_id temporal que no exista en el dataset original
+            temp_user_id = ratings_df["user_id"].max() + 1 
+            new_ratings_df = pd.DataFrame(custom_ratings)
+            new_ratings_df["user_id"] = temp_user_id
+            new_ratings_df["timestamp"] = pd.to_datetime("now").timestamp()
+        
+            # Combinar con los ratings existentes para el modelo SVD
+            # Nota: Para un modelo SVD ya entrenado, las nuevas valoraciones no afectarán el entrenamiento
+            # pero se usarán para predecir las películas no vistas por este usuario temporal.
+            # Aquí, simplemente las añadimos para que el flujo de 'rated_movie_ids' funcione.
+            # En un escenario real, se reentrenaría el modelo o se usaría un enfoque de cold-start más sofisticado.
+            ratings_for_prediction = pd.concat([ratings_df, new_ratings_df], ignore_index=True)
+            current_user_ratings = new_ratings_df # Las valoraciones del usuario actual
+            user_id_to_use = temp_user_id
+        else:
+            ratings_for_prediction = ratings_df
+            current_user_ratings = ratings_df[ratings_df["user_id"] == user_id]
+            user_id_to_use = user_id
+
+    with stage_timer(timings, "candidates"):
+        # Candidatos: películas no valoradas que pasan los filtros (máscara vectorizada)
+        all_movie_ids = movies["movie_id"].to_numpy()
+        candidate_mask = ~np.isin(all_movie_ids, current_user_ratings["movie_id"].to_numpy())
+        if filter_mask is not None:
+            candidate_mask &= filter_mask
+        unrated_movie_ids = pd.unique(all_movie_ids[candidate_mask])
+
+    with stage_timer(timings, "svd_scoring"):
+        if scorer is not None:
+            # Puntuación vectorizada con factores compactos y reordenación exacta
+            top_svd_movies = scorer.top_n(user_id_to_use, candidate_mask, n)
+        else:
+            svd_preds = []
+            for movie_id in unrated_movie_ids:
+                svd_preds.append((movie_id, svd_model.predict(user_id_to_use, movie_id).est))
+            svd_preds.sort(key=lambda x: x[1], reverse=True)
+            top_svd_movies = svd_preds[:n]
+
+    with stage_timer(timings, "content"):
+        content_movie_ids = []
+        if not current_user_ratings.empty:
+            # Usar la película mejor valorada por el usuario para recomendaciones de contenido
+            last_rated_movie_id = current_user_ratings.sort_values(by="rating", ascending=False)["movie_id"].iloc[0]
+            content_recs = get_content_recommendations(last_rated_movie_id, movies, cosine_sim, n=n, filter_mask=filter_mask, content_index=content_index)
+            content_movie_ids = content_recs["movie_id"].tolist()
+
+    with stage_timer(timings, "merge"):
+        top_hybrid_movie_ids = combine_hybrid_scores(top_svd_movies, content_movie_ids, weight_cf, weight_content, n)
+        return movies[movies["movie_id"].isin(top_hybrid_movie_ids)]
+
+# Recomendador Híbrido por lotes (muchos usuarios a la vez)
+def get_bulk_hybrid_recommendations(user_ids, svd_model, movies, cosine_sim, ratings_df, weight_cf=0.7, weight_content=0.3, n=10,
+                                    custom_profiles=None, filter_mask=None, scorer=None, content_index=None, block_size=256):
+    # Generador de (clave, recomendaciones): clave es el user_id o el índice del perfil personalizado.
+    # Los usuarios se procesan en bloques: un solo filtrado de ratings y un producto matricial por bloque.
+    movie_ids = movies["movie_id"].to_numpy()
+    row_of_movie = pd.Series(np.arange(len(movie_ids)), index=movie_ids)
+    qi, bi = align_item_factors(svd_model, movie_ids) if scorer is None else (None, None)
+    base = svd_model.trainset.global_mean if svd_model.biased else 0.0
+    temp_user_id = ratings_df["user_id"].max() + 1
+
+    def entries():
+        user_ids_list = list(user_ids or [])
+        for start in range(0, len(user_ids_list), block_size):
+            block = user_ids_list[start:start + block_size]
+            block_ratings = ratings_df[ratings_df["user_id"].isin(block)]
+            groups = dict(tuple(block_ratings.groupby("user_id", sort=False)))
+            yield [(user_id, user_id, groups.get(user_id, block_ratings.iloc[:0])) for user_id in block]
+        profiles = list(custom_profiles or [])
+        for start in range(0, len(profiles), block_size):
+            yield [(start + i, temp_user_id, pd.DataFrame(profile, columns=["movie_id", "rating"]))
+                   for i, profile in enumerate(profiles[start:start + block_size])]
+
+    for block in entries():
+        candidate_masks = np.vstack([~np.isin(movie_ids, user_ratings["movie_id"].to_numpy()) for _, _, user_ratings in block])
+        if filter_mask is not None:
+            candidate_masks &= filter_mask
+
+        # Puntuación SVD del bloque completo
+        if scorer is None:
+            factors = [user_factors(svd_model, svd_user_id) for _, svd_user_id, _ in block]
+            bu = np.array([f[0] for f in factors])
+            pu = np.vstack([f[1] for f in factors])
+            scores = np.clip(base + bu[:, None] + bi[None, :] + pu @ qi.T, *svd_model.trainset.rating_scale)
+            scores[~candidate_masks] = -np.inf
+            order = np.argsort(-scores, axis=1, kind="stable")[:, :n]
+            top_svd_block = [[(movie_ids[j], scores[b, j]) for j in order[b] if np.isfinite(scores[b, j])] for b in range(len(block))]
+        else:
+            # Los scorers (QuantizedScorer, ShardCoordinator) puntúan el bloque con un solo producto matricial
+            top_svd_block = scorer.top_n_block([svd_user_id for _, svd_user_id, _ in block], candidate_masks, n)
+
+        # Contenido: similitudes de la película mejor valorada de cada usuario
+        content_block = [[] for _ in block]
+        rated = [(b, user_ratings) for b, (_, _, user_ratings) in enumerate(block) if not user_ratings.empty]
+        top_movie_ids = [user_ratings.sort_values(by="rating", ascending=False)["movie_id"].iloc[0] for _, user_ratings in rated]
+        rated = [(b, row_of_movie[mid]) for (b, _), mid in zip(rated, top_movie_ids) if mid in row_of_movie.index]
+        if rated and content_index is not None:
+            for b, idx in rated:
+                content_block[b] = movie_ids[content_index.similar(idx, filter_mask, n)].tolist()
+        elif rated:
+            rows = np.array([idx for _, idx in rated])
+            sims = np.array(cosine_sim[rows], dtype=np.float64)
+            if filter_mask is not None:
+                # Igual que get_content_recommendations con filtros: se excluye la propia película
+                sims[:, ~filter_mask] = -np.inf
+                sims[np.arange(len(rows)), rows] = -np.inf
+                order = np.argsort(-sims, axis=1, kind="stable")[:, :n]
+            else:
+                order = np.argsort(-sims, axis=1, kind="stable")[:, 1:n + 1]
+            for (b, _), sim_row, row_order in zip(rated, sims, order):
+                content_block[b] = movie_ids[row_order[np.isfinite(sim_row[row_order])]].tolist()
+
+        for (key, _, _), top_svd_movies, content_movie_ids in zip(block, top_svd_block, content_block):
+            top_hybrid_movie_ids = combine_hybrid_scores(top_svd_movies, content_movie_ids, weight_cf, weight_content, n)
+            yield key, movies[movies["movie_id"].isin(top_hybrid_movie_ids)]
 
 
 if __name__ == "__main__":
@@ -120,20 +274,12 @@ if __name__ == "__main__":
     popular_movies = get_popular_recommendations(ratings, movies, n=10)
     print(popular_movies[["title", "genres"]])
 
-    print("\nEntrenando modelo SVD...")
-    svd_model, svd_rmse = train_svd_model(ratings)
-    print(f"RMSE del modelo SVD: {svd_rmse:.4f}")
-    with open(os.path.join(os.path.dirname(__file__), "..", "models", "svd_model.pkl"), "wb") as f:
-        pickle.dump(svd_model, f)
-    print("Modelo SVD guardado en models/svd_model.pkl")
-
-    print("\nEntrenando recomendador de contenido...")
-    tfidf_vectorizer, cosine_sim_matrix = train_content_model(movies)
-    with open(os.path.join(os.path.dirname(__file__), "..", "models", "tfidf_vectorizer.pkl"), "wb") as f:
-        pickle.dump(tfidf_vectorizer, f)
-    with open(os.path.join(os.path.dirname(__file__), "..", "models", "cosine_sim_matrix.pkl"), "wb") as f:
-        pickle.dump(cosine_sim_matrix, f)
-    print("Vectorizador TF-IDF y matriz de similitud de coseno guardados en models/")
+    # Los modelos se entrenan con `python train.py` (pipeline con caché); aquí solo se cargan
+    models_path = os.path.join(os.path.dirname(__file__), "..", "models")
+    with open(os.path.join(models_path, "svd_model.pkl"), "rb") as f:
+        svd_model = pickle.load(f)
+    with open(os.path.join(models_path, "cosine_sim_matrix.pkl"), "rb") as f:
+        cosine_sim_matrix = pickle.load(f)
 
     toy_story_id = 1
     print(f"\nRecomendaciones de contenido para la película ID {toy_story_id} (Toy Story (1995)): ")
@@ -145,8 +291,6 @@ if __name__ == "__main__":
     hybrid_recs = get_hybrid_recommendations(user_id_example, svd_model, movies, cosine_sim_matrix, ratings, n=10)
     print(hybrid_recs[["title", "genres"]])
 
-    print("\nComponentes del modelo híbrido (SVD, TF-IDF, Cosine Sim) guardados.")
-
     # Ejemplo de uso con valoraciones personalizadas
     print("\nGenerando recomendaciones híbridas para un perfil personalizado...")
     custom_user_ratings = [
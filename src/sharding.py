@@ -0,0 +1,195 @@
+import heapq
+import multiprocessing
+import threading
+import time
+from itertools import chain
+
+import numpy as np
+
+from quantization import align_item_factors, user_factors
+
+# Modo particionado: el catálogo se reparte en N shards (rangos contiguos de filas de
+# `movies`). Cada shard guarda sus factores de película y sus columnas de la matriz de
+# similitud, calcula su top-n local y el coordinador fusiona los resultados con un heap.
+
+class ItemShard:
+    def __init__(self, start, movie_ids, qi, bi, content_sim, global_mean, rating_scale, biased):
+        self.start = start
+        self.movie_ids = movie_ids
+        self.qi = qi
+        self.bi = bi
+        self.content_sim = content_sim  # (películas del catálogo x películas del shard)
+        self.global_mean = global_mean
+        self.rating_scale = rating_scale
+        self.biased = biased
+
+    def _local_top_n(self, scores, n):
+        # Devuelve (puntuación, fila global) de las n mejores películas del shard
+        if n <= 0:
+            return []
+        valid = np.flatnonzero(np.isfinite(scores))
+        if len(valid) > n:
+            # Los empates en el umbral se resuelven por fila (las puntuaciones recortadas a 5 empatan a menudo)
+            kth = np.partition(scores[valid], len(valid) - n)[len(valid) - n]
+            above = valid[scores[valid] > kth]
+            ties = valid[scores[valid] == kth][:n - len(above)]
+            valid = np.concatenate([above, ties])
+        return [(float(scores[i]), self.start + int(i)) for i in valid]
+
+    def top_n_cf_block(self, bu, pu, candidate_masks, n):
+        # bu: sesgos de un bloque de usuarios; pu: sus factores (usuarios x factores)
+        scores = pu @ self.qi.T + self.bi
+        if self.biased:
+            scores += self.global_mean + bu[:, None]
+        scores = np.clip(scores, *self.rating_scale)
+        scores[~candidate_masks] = -np.inf
+        return [self._local_top_n(row, n) for row in scores]
+
+    def top_n_cf(self, bu, pu, candidate_mask, n):
+        return self.top_n_cf_block(np.array([bu]), pu[None, :], candidate_mask[None, :], n)[0]
+
+    def top_n_content(self, movie_row, filter_mask, n):
+        scores = np.array(self.content_sim[movie_row], dtype=np.float64)
+        if filter_mask is not None:
+            scores[~filter_mask] = -np.inf
+        local_row = movie_row - self.start
+        if 0 <= local_row < len(scores):
+            scores[local_row] = -np.inf
+        return self._local_top_n(scores, n)
+
+def _shard_worker(conn, shard):
+    while True:
+        message = conn.recv()
+        if message is None:
+            break
+        seq, method, args = message
+        try:
+            conn.send((seq, True, getattr(shard, method)(*args)))
+        except Exception as e:
+            conn.send((seq, False, repr(e)))
+    conn.close()
+
+class ShardUnavailableError(RuntimeError):
+    pass
+
+class LocalShardClient:
+    # Shard ejecutado en un proceso local. Un cliente remoto solo necesita
+    # implementar submit(), result() y close() con la misma semántica.
+    def __init__(self, shard, timeout=30.0):
+        ctx = multiprocessing.get_context("spawn")
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_shard_worker, args=(child_conn, shard), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.timeout = timeout
+        self.seq = 0
+        self.alive = True
+
+    def _check_alive(self):
+        if not self.alive or not self.process.is_alive():
+            self.alive = False
+            raise ShardUnavailableError(f"Shard no disponible (proceso {self.process.pid} terminado)")
+
+    def submit(self, method, *args):
+        self._check_alive()
+        self.seq += 1
+        try:
+            self.conn.send((self.seq, method, args))
+        except (BrokenPipeError, OSError):
+            self.alive = False
+            raise ShardUnavailableError(f"Shard no disponible (proceso {self.process.pid} terminado)")
+
+    def result(self):
+        # Cada respuesta lleva el número de la petición: las respuestas atrasadas de
+        # peticiones anteriores (p. ej. tras un timeout) se descartan
+        deadline = time.monotonic() + self.timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0 or not self.conn.poll(remaining):
+                    raise TimeoutError(f"El shard no respondió en {self.timeout}s")
+                seq, ok, value = self.conn.recv()
+            except (EOFError, OSError):
+                self.alive = False
+                raise ShardUnavailableError(f"Shard no disponible (proceso {self.process.pid} terminado)")
+            if seq == self.seq:
+                break
+        if not ok:
+            raise RuntimeError(f"Error en el shard: {value}")
+        return value
+
+    def close(self):
+        try:
+            self.conn.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.conn.close()
+
+class ShardCoordinator:
+    def __init__(self, svd_model, movies, cosine_sim, n_shards=2, client_factory=LocalShardClient):
+        self.svd_model = svd_model
+        self.movie_ids = movies["movie_id"].to_numpy()
+        qi, bi = align_item_factors(svd_model, self.movie_ids)
+        bounds = np.linspace(0, len(self.movie_ids), n_shards + 1).astype(int)
+        self.ranges = list(zip(bounds[:-1], bounds[1:]))
+        self.clients = [
+            client_factory(ItemShard(
+                int(start), self.movie_ids[start:stop], qi[start:stop], bi[start:stop],
+                cosine_sim[:, start:stop], svd_model.trainset.global_mean,
+                svd_model.trainset.rating_scale, svd_model.biased
+            ))
+            for start, stop in self.ranges
+        ]
+        self.lock = threading.Lock()
+
+    def _scatter_gather(self, method, make_args):
+        # Se envía la petición a todos los shards antes de esperar respuestas. Se leen
+        # todas las respuestas aunque algún shard falle y el error se lanza al final.
+        errors = []
+        results = []
+        with self.lock:
+            submitted = []
+            for client, (start, stop) in zip(self.clients, self.ranges):
+                try:
+                    client.submit(method, *make_args(start, stop))
+                    submitted.append(client)
+                except Exception as e:
+                    errors.append(e)
+            for client in submitted:
+                try:
+                    results.append(client.result())
+                except Exception as e:
+                    errors.append(e)
+        if errors:
+            raise RuntimeError(f"Fallo en {len(errors)} de {len(self.clients)} shards: {errors[0]}")
+        return results
+
+    def _merge(self, shard_results, n):
+        # Desempate por fila para reproducir el orden estable de la versión sin shards
+        return heapq.nlargest(n, chain.from_iterable(shard_results), key=lambda item: (item[0], -item[1]))
+
+    def top_n(self, user_id, candidate_mask, n=10):
+        return self.top_n_block([user_id], candidate_mask[None, :], n)[0]
+
+    def top_n_block(self, user_ids, candidate_masks, n=10):
+        # Un solo mensaje por shard para todo el bloque de usuarios
+        factors = [user_factors(self.svd_model, user_id) for user_id in user_ids]
+        bu = np.array([f[0] for f in factors])
+        pu = np.vstack([f[1] for f in factors])
+        results = self._scatter_gather("top_n_cf_block", lambda start, stop: (bu, pu, candidate_masks[:, start:stop], n))
+        return [[(self.movie_ids[row], score) for score, row in self._merge([r[b] for r in results], n)]
+                for b in range(len(user_ids))]
+
+    def similar(self, movie_row, filter_mask, n=10):
+        results = self._scatter_gather(
+            "top_n_content",
+            lambda start, stop: (movie_row, filter_mask[start:stop] if filter_mask is not None else None, n)
+        )
+        return [row for _, row in self._merge(results, n)]
+
+    def close(self):
+        for client in self.clients:
+            client.close()
@@ -0,0 +1,34 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+from surprise import Dataset, Reader, SVD
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+from recommend import add_soup, fit_tfidf, build_cosine_index, build_movie_index
+
+GENRES = ["Action", "Comedy", "Drama", "Horror", "Romance", "Sci-Fi", "War"]
+WORDS = ["love", "war", "star", "night", "city", "dark", "king", "blue"]
+
+@pytest.fixture(scope="session")
+def data():
+    rng = np.random.default_rng(0)
+    n_movies, n_users = 120, 60
+    movies = pd.DataFrame({
+        "movie_id": np.arange(1, n_movies + 1),
+        "title": [f"{' '.join(rng.choice(WORDS, 2))} ({rng.integers(1950, 2001)})" for _ in range(n_movies)],
+        "genres": ["|".join(rng.choice(GENRES, rng.integers(1, 3), replace=False)) for _ in range(n_movies)],
+    })
+    rows = []
+    for user_id in range(1, n_users + 1):
+        for movie_id in rng.choice(n_movies, rng.integers(5, 25), replace=False) + 1:
+            rows.append((user_id, int(movie_id), int(rng.integers(1, 6)), 0))
+    ratings = pd.DataFrame(rows, columns=["user_id", "movie_id", "rating", "timestamp"])
+    trainset = Dataset.load_from_df(ratings[["user_id", "movie_id", "rating"]], Reader(rating_scale=(1, 5))).build_full_trainset()
+    svd_model = SVD(n_factors=10, n_epochs=5, random_state=42)
+    svd_model.fit(trainset)
+    cosine_sim = build_cosine_index(fit_tfidf(add_soup(movies), stop_words="english")[1])
+    genre_masks, release_years = build_movie_index(movies)
+    return svd_model, movies, cosine_sim, ratings, genre_masks, release_years
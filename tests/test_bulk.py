@@ -0,0 +1,54 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+from recommend import get_hybrid_recommendations, get_bulk_hybrid_recommendations, build_filter_mask
+from quantization import QuantizedScorer
+from sharding import ShardCoordinator
+
+FILTERS = [{}, {"include_genres": ["Drama", "Comedy"]}, {"exclude_genres": ["War"], "min_year": 1970}]
+
+@pytest.fixture(scope="module")
+def profiles(data):
+    _, movies, _, _, _, _ = data
+    rng = np.random.default_rng(1)
+    return [
+        [{"movie_id": int(movie_id), "rating": int(rng.integers(1, 6))} for movie_id in rng.choice(movies["movie_id"], rng.integers(1, 6), replace=False)]
+        for _ in range(9)
+    ]
+
+@pytest.fixture(scope="module", params=["exact", "float32", "int8", "shards"])
+def scorers(request, data):
+    # (scorer, content_index) tal como los configura la API en cada modo
+    svd_model, movies, cosine_sim, _, _, _ = data
+    if request.param == "exact":
+        yield None, None
+    elif request.param == "shards":
+        coordinator = ShardCoordinator(svd_model, movies, cosine_sim, n_shards=2)
+        yield coordinator, coordinator
+        coordinator.close()
+    else:
+        yield QuantizedScorer(svd_model, movies, dtype=request.param), None
+
+@pytest.mark.parametrize("filters", FILTERS)
+def test_bulk_matches_per_user_and_per_profile(data, profiles, scorers, filters):
+    svd_model, movies, cosine_sim, ratings, genre_masks, release_years = data
+    scorer, content_index = scorers
+    filter_mask = build_filter_mask(genre_masks, release_years, **filters)
+    user_ids = ratings["user_id"].unique().tolist()
+    # block_size=7 no divide ni a los 60 usuarios ni a los 9 perfiles
+    results = list(get_bulk_hybrid_recommendations(user_ids, svd_model, movies, cosine_sim, ratings, n=10, custom_profiles=profiles,
+                                                   filter_mask=filter_mask, scorer=scorer, content_index=content_index, block_size=7))
+    assert [key for key, _ in results] == user_ids + list(range(len(profiles)))
+
+    for user_id, recs in results[:len(user_ids)]:
+        expected = get_hybrid_recommendations(user_id, svd_model, movies, cosine_sim, ratings, n=10, filter_mask=filter_mask,
+                                              scorer=scorer, content_index=content_index)
+        assert recs["movie_id"].tolist() == expected["movie_id"].tolist()
+    for index, recs in results[len(user_ids):]:
+        expected = get_hybrid_recommendations(None, svd_model, movies, cosine_sim, ratings, n=10, custom_ratings=profiles[index],
+                                              filter_mask=filter_mask, scorer=scorer, content_index=content_index)
+        assert recs["movie_id"].tolist() == expected["movie_id"].tolist()
@@ -0,0 +1,47 @@
+import copy
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+from pipeline import STAGES, DEFAULT_PARAMS, compute_stage_keys, plan_stages, run_pipeline
+
+@pytest.fixture
+def data_path(tmp_path, data):
+    _, movies, _, ratings, _, _ = data
+    path = tmp_path / "ml-1m"
+    path.mkdir()
+    with open(path / "movies.dat", "w", encoding="latin-1") as f:
+        for row in movies.itertuples():
+            f.write(f"{row.movie_id}::{row.title}::{row.genres}\n")
+    with open(path / "ratings.dat", "w") as f:
+        for row in ratings.itertuples():
+            f.write(f"{row.user_id}::{row.movie_id}::{row.rating}::{row.timestamp}\n")
+    return str(path)
+
+@pytest.fixture
+def params():
+    params = copy.deepcopy(DEFAULT_PARAMS)
+    params["svd"].update(n_factors=5, n_epochs=2)
+    return params
+
+def test_changing_svd_params_only_reruns_train_cf_and_evaluate(tmp_path, data_path, params):
+    cache_dir = str(tmp_path / "cache")
+    keys = run_pipeline(params=params, data_path=data_path, models_path=str(tmp_path / "models"), cache_dir=cache_dir, max_workers=1)
+    assert plan_stages(list(STAGES), keys, cache_dir) == set()
+
+    params["svd"]["n_factors"] = 8
+    new_keys = compute_stage_keys(params, data_path)
+    assert {name for name in STAGES if new_keys[name] != keys[name]} == {"train_cf", "evaluate"}
+    assert plan_stages(list(STAGES), new_keys, cache_dir) == {"train_cf", "evaluate"}
+
+def test_run_pipeline_prunes_stale_cache_entries(tmp_path, data_path, params):
+    cache_dir = str(tmp_path / "cache")
+    models_path = str(tmp_path / "models")
+    run_pipeline(params=params, data_path=data_path, models_path=models_path, cache_dir=cache_dir, max_workers=1)
+    params["svd"]["n_epochs"] = 3
+    keys = run_pipeline(params=params, data_path=data_path, models_path=models_path, cache_dir=cache_dir, max_workers=1)
+    for name in STAGES:
+        assert os.listdir(os.path.join(cache_dir, name)) == [keys[name]]
+    assert os.path.exists(os.path.join(models_path, "metrics.json"))
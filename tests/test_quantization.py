@@ -0,0 +1,25 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+from recommend import build_filter_mask
+from quantization import QuantizedScorer, SCORING_DTYPES
+
+@pytest.mark.parametrize("dtype", SCORING_DTYPES)
+def test_top_n_matches_exact_ranking_with_filters(data, dtype):
+    svd_model, movies, _, ratings, genre_masks, release_years = data
+    scorer = QuantizedScorer(svd_model, movies, dtype=dtype, rerank_factor=len(movies))
+    for candidate_mask in (np.ones(len(movies), dtype=bool), build_filter_mask(genre_masks, release_years, include_genres=["War"])):
+        for user_id in ratings["user_id"].unique()[:20]:
+            assert scorer.top_n(user_id, candidate_mask, 10) == scorer.exact_top_n(user_id, candidate_mask, 10)
+
+@pytest.mark.parametrize("dtype", SCORING_DTYPES)
+def test_report_includes_measured_latency(data, dtype):
+    svd_model, movies, _, ratings, _, _ = data
+    report = QuantizedScorer(svd_model, movies, dtype=dtype).report(ratings["user_id"].unique()[:5].tolist())
+    assert report["users"] == 5
+    assert report["approx_rerank_ms_per_user"] > 0 and report["float64_gemv_ms_per_user"] > 0
+    assert report["temporary_bytes"] == (0 if dtype == "float32" else len(movies) * svd_model.qi.shape[1] * 4)
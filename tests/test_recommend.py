@@ -0,0 +1,68 @@
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+from recommend import (GENRE_BITS, build_movie_index, build_filter_mask, get_hybrid_recommendations,
+                       get_content_recommendations, get_popular_recommendations)
+
+@pytest.fixture
+def small_movies():
+    return pd.DataFrame({
+        "movie_id": [1, 2, 3, 4],
+        "title": ["Toy Story (1995)", "Alien (1979)", "Untitled", "Heat (1995) "],
+        "genres": ["Animation|Children's|Comedy", "Horror|Sci-Fi", "Drama", "Action|Crime|Unknown"],
+    })
+
+def test_build_movie_index_assigns_one_bit_per_genre(small_movies):
+    genre_masks, release_years = build_movie_index(small_movies)
+    assert genre_masks[0] == GENRE_BITS["Animation"] | GENRE_BITS["Children's"] | GENRE_BITS["Comedy"]
+    assert genre_masks[1] == GENRE_BITS["Horror"] | GENRE_BITS["Sci-Fi"]
+    assert genre_masks[2] == GENRE_BITS["Drama"]
+    # Los géneros desconocidos se ignoran
+    assert genre_masks[3] == GENRE_BITS["Action"] | GENRE_BITS["Crime"]
+    assert release_years.tolist() == [1995, 1979, 0, 1995]
+    assert len(set(GENRE_BITS.values())) == len(GENRE_BITS)
+
+def test_build_filter_mask_include_and_exclude(small_movies):
+    genre_masks, release_years = build_movie_index(small_movies)
+    assert build_filter_mask(genre_masks, release_years) is None
+    # include: al menos uno de los géneros; exclude: ninguno de ellos
+    assert build_filter_mask(genre_masks, release_years, include_genres=["Comedy", "Horror"]).tolist() == [True, True, False, False]
+    assert build_filter_mask(genre_masks, release_years, exclude_genres=["Comedy", "Crime"]).tolist() == [False, True, True, False]
+    assert build_filter_mask(genre_masks, release_years, include_genres=["Sci-Fi"], exclude_genres=["Horror"]).tolist() == [False] * 4
+    with pytest.raises(ValueError):
+        build_filter_mask(genre_masks, release_years, include_genres=["Nope"])
+
+def test_build_filter_mask_years_exclude_titles_without_year(small_movies):
+    genre_masks, release_years = build_movie_index(small_movies)
+    assert build_filter_mask(genre_masks, release_years, max_year=1990).tolist() == [False, True, False, False]
+    assert build_filter_mask(genre_masks, release_years, min_year=1900).tolist() == [True, True, False, True]
+    assert build_filter_mask(genre_masks, release_years, min_year=1995, max_year=1995).tolist() == [True, False, False, True]
+
+def test_build_filter_mask_rejects_inverted_year_range(small_movies):
+    genre_masks, release_years = build_movie_index(small_movies)
+    with pytest.raises(ValueError):
+        build_filter_mask(genre_masks, release_years, min_year=2000, max_year=1990)
+
+@pytest.mark.parametrize("filters", [{"include_genres": ["Drama", "Comedy"]}, {"exclude_genres": ["War", "Horror"], "min_year": 1960}])
+def test_filtered_recommendations_return_full_pages(data, filters):
+    svd_model, movies, cosine_sim, ratings, genre_masks, release_years = data
+    filter_mask = build_filter_mask(genre_masks, release_years, **filters)
+    allowed = set(movies["movie_id"][filter_mask])
+    n = 10
+    assert len(allowed) > 3 * n
+
+    popular = get_popular_recommendations(ratings, movies, n=n, filter_mask=filter_mask)
+    assert len(popular) == n and set(popular["movie_id"]) <= allowed
+
+    for movie_id in movies["movie_id"][:20]:
+        content = get_content_recommendations(movie_id, movies, cosine_sim, n=n, filter_mask=filter_mask)
+        assert len(content) == n and set(content["movie_id"]) <= allowed
+        assert movie_id not in set(content["movie_id"])
+
+    for user_id in ratings["user_id"].unique()[:20]:
+        hybrid = get_hybrid_recommendations(user_id, svd_model, movies, cosine_sim, ratings, n=n, filter_mask=filter_mask)
+        assert len(hybrid) == n and set(hybrid["movie_id"]) <= allowed
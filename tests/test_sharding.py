@@ -0,0 +1,53 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+from recommend import get_hybrid_recommendations, get_content_recommendations, build_filter_mask
+from sharding import ShardCoordinator
+
+@pytest.fixture(scope="module", params=[1, 3])
+def coordinator(request, data):
+    svd_model, movies, cosine_sim, _, _, _ = data
+    coordinator = ShardCoordinator(svd_model, movies, cosine_sim, n_shards=request.param)
+    yield coordinator
+    coordinator.close()
+
+@pytest.mark.parametrize("filters", [{}, {"include_genres": ["Drama", "Comedy"]}, {"exclude_genres": ["War"], "min_year": 1970}])
+def test_sharded_hybrid_matches_unsharded(data, coordinator, filters):
+    svd_model, movies, cosine_sim, ratings, genre_masks, release_years = data
+    filter_mask = build_filter_mask(genre_masks, release_years, **filters)
+    for user_id in ratings["user_id"].unique():
+        expected = get_hybrid_recommendations(user_id, svd_model, movies, cosine_sim, ratings, n=10, filter_mask=filter_mask)
+        sharded = get_hybrid_recommendations(user_id, svd_model, movies, None, ratings, n=10, filter_mask=filter_mask,
+                                             scorer=coordinator, content_index=coordinator)
+        assert sharded["movie_id"].tolist() == expected["movie_id"].tolist()
+
+def test_sharded_content_matches_unsharded_with_filters(data, coordinator):
+    _, movies, cosine_sim, _, genre_masks, release_years = data
+    filter_mask = build_filter_mask(genre_masks, release_years, include_genres=["Action"])
+    for movie_id in movies["movie_id"]:
+        expected = get_content_recommendations(movie_id, movies, cosine_sim, n=5, filter_mask=filter_mask)
+        sharded = get_content_recommendations(movie_id, movies, None, n=5, filter_mask=filter_mask, content_index=coordinator)
+        assert sharded["movie_id"].tolist() == expected["movie_id"].tolist()
+
+def test_shard_error_does_not_leave_stale_replies(data, coordinator):
+    _, movies, cosine_sim, _, _, _ = data
+    with pytest.raises(RuntimeError):
+        coordinator.similar(10 ** 6, None, n=5)
+    expected = get_content_recommendations(movies["movie_id"].iloc[0], movies, cosine_sim, n=5, filter_mask=np.ones(len(movies), dtype=bool))
+    assert movies.iloc[coordinator.similar(0, None, n=5)]["movie_id"].tolist() == expected["movie_id"].tolist()
+
+def test_dead_shard_is_rejected_without_hanging(data):
+    svd_model, movies, cosine_sim, _, _, _ = data
+    coordinator = ShardCoordinator(svd_model, movies, cosine_sim, n_shards=2)
+    try:
+        coordinator.clients[0].process.kill()
+        coordinator.clients[0].process.join()
+        for _ in range(2):
+            with pytest.raises(RuntimeError, match="no disponible"):
+                coordinator.similar(0, None, n=5)
+    finally:
+        coordinator.close()
@@ -1,65 +1,32 @@
-import pandas as pd
-from surprise import Dataset, Reader, SVD
-from surprise.model_selection import train_test_split
-from surprise import accuracy
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-import numpy as np
-import pickle
+import argparse
+import json
 import os
+import sys
 
-# Cargar datos
-def load_data(movies_path, ratings_path):
-    rnames = ["user_id", "movie_id", "rating", "timestamp"]
-    mnames = ["movie_id", "title", "genres"]
-    ratings = pd.read_csv(ratings_path, sep="::", header=None, names=rnames, engine="python")
-    movies = pd.read_csv(movies_path, sep="::", header=None, names=mnames, engine="python", encoding="latin-1")
-    return ratings, movies
-
-# Filtrado Colaborativo (SVD)
-def train_svd_model(ratings):
-    reader = Reader(rating_scale=(1, 5))
-    data = Dataset.load_from_df(ratings[["user_id", "movie_id", "rating"]], reader)
-    trainset, testset = train_test_split(data, test_size=0.2, random_state=42)
-    model = SVD(random_state=42)
-    model.fit(trainset)
-    predictions = model.test(testset)
-    rmse = accuracy.rmse(predictions)
-    return model, rmse
-
-# Recomendador de Contenido (TF-IDF)
-def train_content_model(movies):
-    movies["soup"] = movies["title"] + " " + movies["genres"]
-    tfidf = TfidfVectorizer(stop_words="english")
-    tfidf_matrix = tfidf.fit_transform(movies["soup"])
-    cosine_sim = cosine_similarity(tfidf_matrix, tfidf_matrix)
-    return tfidf, cosine_sim, movies # Return movies with soup column
+# Añadir el directorio src al path para importar el pipeline
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+from pipeline import STAGES, load_params, run_pipeline
 
 
 if __name__ == "__main__":
-    data_path = "./data/ml-1m/"
-    movies_path = os.path.join(data_path, "movies.dat")
-    ratings_path = os.path.join(data_path, "ratings.dat")
+    parser = argparse.ArgumentParser(description="Pipeline de entrenamiento por etapas con caché de artefactos")
+    parser.add_argument("--stage", action="append", choices=list(STAGES),
+                        help="Etapa a ejecutar (se puede repetir). Por defecto, todas.")
+    parser.add_argument("--params", default="params.yaml", help="Fichero de parámetros")
+    parser.add_argument("--workers", type=int, default=None, help="Número máximo de procesos en paralelo")
+    parser.add_argument("--keep-cache", action="store_true",
+                        help="No borrar las entradas de caché antiguas de las etapas ejecutadas")
+    args = parser.parse_args()
 
-    ratings, movies = load_data(movies_path, ratings_path)
-
-    # Entrenar modelo SVD
-    print("\nEntrenando modelo SVD...")
-    svd_model, svd_rmse = train_svd_model(ratings)
-    print(f"RMSE del modelo SVD: {svd_rmse:.4f}")
-    with open("./models/svd_model.pkl", "wb") as f:
-        pickle.dump(svd_model, f)
-    print("Modelo SVD guardado en models/svd_model.pkl")
-
-    # Entrenar recomendador de contenido
-    print("\nEntrenando recomendador de contenido...")
-    tfidf_vectorizer, cosine_sim_matrix, movies_with_soup = train_content_model(movies)
-    with open("./models/tfidf_vectorizer.pkl", "wb") as f:
-        pickle.dump(tfidf_vectorizer, f)
-    with open("./models/cosine_sim_matrix.pkl", "wb") as f:
-        pickle.dump(cosine_sim_matrix, f)
-    with open("./models/movies_with_soup.pkl", "wb") as f:
-        pickle.dump(movies_with_soup, f)
-    print("Vectorizador TF-IDF, matriz de similitud de coseno y películas con columna soup guardados en models/")
+    data_path = "./data/ml-1m/"
+    models_path = "./models/"
 
+    params = load_params(args.params)
+    run_pipeline(args.stage, params=params, data_path=data_path, models_path=models_path, max_workers=args.workers,
+                 prune=not args.keep_cache)
 
+    metrics_path = os.path.join(models_path, "metrics.json")
+    if (args.stage is None or "evaluate" in args.stage) and os.path.exists(metrics_path):
+        with open(metrics_path) as f:
+            print(f"RMSE del modelo SVD: {json.load(f)['rmse']:.4f}")
+    print("Artefactos del pipeline guardados en models/")